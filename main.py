@@ -1,15 +1,20 @@
 import asyncio
+import copy
 import logging
 import os
 import re
 import shutil
 import tempfile
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
 from pathlib import Path
-from urllib.parse import urlparse
 
-from telegram import Update, BotCommand
+from telegram import BotCommand, InputFile, Update
 from telegram.constants import MessageEntityType
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters
+from telegram.request import HTTPXRequest
 
 import yt_dlp
 
@@ -18,17 +23,55 @@ MAX_TG_BYTES = int(os.getenv("MAX_TG_BYTES", str(1_900_000_000)))  # ~1.9 GB saf
 NO_FFMPEG = os.getenv("NO_FFMPEG", "0") == "1"
 DEFAULT_FORMAT = "best[ext=mp4]/best" if NO_FFMPEG else "bv*+ba/best"
 IG_SESSIONID = os.getenv("IG_SESSIONID")
+HAS_ARIA2C = shutil.which("aria2c") is not None
+UPLOAD_TIMEOUT = float(os.getenv("UPLOAD_TIMEOUT", "600"))  # seconds; large uploads outlive PTB's defaults
+TG_URL_FETCH_BYTES = 20 * 1024 * 1024  # Telegram fetches video URLs itself up to this size
+CONCURRENT_FRAGMENTS = int(os.getenv("CONCURRENT_FRAGMENTS", "10"))  # parallel HLS/DASH fragment fetches
+MAX_PARALLEL_DL = int(os.getenv("MAX_PARALLEL_DL", "4"))  # per-chat download fan-out
+MAX_PARALLEL_DOWNLOADS = int(os.getenv("MAX_PARALLEL_DOWNLOADS", "8"))  # bot-wide cap across chats
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(name)s | %(message)s")
 log = logging.getLogger("tg_video_bot")
 
 URL_RE = re.compile(r"https?://\S+")
-SUPPORTED_DOMAINS = (
+_RAW_DOMAINS = (
     "youtube.com", "youtu.be", "m.youtube.com",
     "instagram.com", "instagr.am", "www.instagram.com",
     "tiktok.com", "vm.tiktok.com", "facebook.com", "fb.watch",
     "twitter.com", "x.com", "vimeo.com"
 )
+# Subdomains of another entry are already covered by the matchers; keep registrable roots only.
+SUPPORTED_DOMAINS = tuple(sorted(
+    d for d in _RAW_DOMAINS if not any(d.endswith("." + o) for o in _RAW_DOMAINS)
+))
+_DOMAIN_SET = frozenset(SUPPORTED_DOMAINS)
+_DOMAIN_MAX_LABELS = max(d.count(".") + 1 for d in SUPPORTED_DOMAINS)
+
+# Fold words into one alternation that shares common prefixes, e.g. youtu(?:.be|be.com).
+def _trie_regex(words) -> str:
+    trie: dict = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def emit(node: dict) -> str:
+        alts = [re.escape(ch) + emit(sub) for ch, sub in sorted(node.items()) if ch]
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        if "" in node:
+            return "(?:" + body + ")?"
+        return body
+
+    return emit(trie)
+
+# Only links on supported hosts (any subdomain), in a single pass over the message.
+_SUPPORTED_URL_RE = re.compile(
+    r"https?://(?:[^\s/?#]*[.@])?(?:" + _trie_regex(SUPPORTED_DOMAINS) + r")(?=[/:?#]|\s|$)\S*",
+    re.IGNORECASE,
+)
 
 # ------------ Localization ------------
 TEXTS = {
@@ -82,133 +125,470 @@ def get_lang(update: Update) -> str:
     code = (update.effective_user.language_code or "").lower()
     return "ru" if code.startswith("ru") else "en"
 
+# Strings without placeholders need no .format() at all.
+_STATIC = {(lang, key): v for lang, d in TEXTS.items() for key, v in d.items() if "{" not in v}
+
 def t(lang: str, key: str, **kw) -> str:
+    s = _STATIC.get((lang, key))
+    if s is not None:
+        return s
     return TEXTS.get(lang, TEXTS["en"]).get(key, TEXTS["en"].get(key, key)).format(**kw)
 
+# /start and /help render the same text for every user of a language.
+_START_RENDERED = {
+    lang: t(lang, "start", mode=t(lang, "mode_noff" if NO_FFMPEG else "mode_ff")) + "\n\n" + t(lang, "help_hint")
+    for lang in TEXTS
+}
+
 # ------------ Helpers ------------
+def _host_of(url: str) -> str:
+    # Just the authority's host; urlparse does a full RFC 3986 split we don't need.
+    i = url.find("://")
+    if i < 0:
+        return ""
+    j = i + 3
+    end = len(url)
+    for c in ("/", "?", "#"):
+        k = url.find(c, j)
+        if 0 <= k < end:
+            end = k
+    host = url[j:end]
+    at = host.rfind("@")
+    if at >= 0:
+        host = host[at + 1:]
+    colon = host.rfind(":")
+    if colon > 0 and host[colon + 1:].isdigit():
+        host = host[:colon]
+    return host.lower()
+
 def is_supported_url(url: str) -> bool:
-    try:
-        host = urlparse(url).netloc.lower()
-    except Exception:
-        return False
-    return any(host.endswith(d) for d in SUPPORTED_DOMAINS)
+    host = _host_of(url)
+    # Probe the registrable tails ("youtube.com", "m.youtube.com", ...) right to left.
+    labels = host.split(".")
+    for k in range(2, min(len(labels), _DOMAIN_MAX_LABELS) + 1):
+        if ".".join(labels[-k:]) in _DOMAIN_SET:
+            return True
+    return False
 
-def find_urls(text: str) -> list[str]:
-    return URL_RE.findall(text or "")
+_IG_COOKIE_BYTES = (
+    "# Netscape HTTP Cookie File\n"
+    ".instagram.com\tTRUE\t/\tTRUE\t2147483647\tsessionid\t" + IG_SESSIONID + "\n"
+).encode("utf-8") if IG_SESSIONID else b""
+
+def _init_ram_tmp_root() -> Path | None:
+    fast = os.getenv("TMPDIR_FAST")
+    if fast:
+        root = Path(fast)
+    elif Path("/dev/shm").is_dir():
+        root = Path("/dev/shm") / "tgvb"
+    else:
+        return None
+    try:
+        root.mkdir(parents=True, exist_ok=True)
+    except OSError:
+        return None
+    return root
+
+# Fast staging area (TMPDIR_FAST or tmpfs): transient downloads skip the disk when they fit.
+_RAM_TMP_ROOT = _init_ram_tmp_root()
+
+# Per byte of media: ffmpeg holds the parts and the merged file at once.
+_RAM_FOOTPRINT = 2
+_ram_reserved = 0
+_RAM_LOCK = threading.Lock()
+
+# Reserve fast-staging room for a download of `size` bytes; 0 means it won't fit.
+def _reserve_ram(size: int) -> int:
+    global _ram_reserved
+    if size <= 0:
+        return 0
+    need = size * _RAM_FOOTPRINT
+    with _RAM_LOCK:
+        if _ram_reserved + need > shutil.disk_usage(_RAM_TMP_ROOT).free:
+            return 0
+        _ram_reserved += need
+    return need
+
+def _release_ram(reserved: int) -> None:
+    global _ram_reserved
+    with _RAM_LOCK:
+        _ram_reserved -= reserved
+
+def _message_urls(message) -> list[str]:
+    # Telegram already tokenized the links; only scan the text when it sent no entities.
+    entities = message.parse_entities([MessageEntityType.URL, MessageEntityType.TEXT_LINK])
+    if not entities:
+        return _SUPPORTED_URL_RE.findall(message.text or "")
+    urls = []
+    for entity, text in entities.items():
+        url = entity.url if entity.type == MessageEntityType.TEXT_LINK else text
+        if "://" not in url:
+            url = "https://" + url
+        if is_supported_url(url):
+            urls.append(url)
+    return urls
 
 def _write_cookies_if_needed(tmp: Path) -> str | None:
     if not IG_SESSIONID:
         return None
     cookies_path = tmp / "cookies.txt"
-    cookies_path.write_text(
-        "# Netscape HTTP Cookie File\n"
-        ".instagram.com\tTRUE\t/\tTRUE\t2147483647\tsessionid\t" + IG_SESSIONID + "\n",
-        encoding="utf-8",
-    )
+    fd = os.open(cookies_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        os.write(fd, _IG_COOKIE_BYTES)
+    finally:
+        os.close(fd)
     return str(cookies_path)
 
+_MEDIA_EXTS = frozenset(("mp4", "mov", "mkv", "webm"))
+
 def _pick_final_file(dirpath: Path) -> Path | None:
-    media = [p for p in dirpath.glob("**/*") if p.is_file() and p.suffix.lower() in (".mp4", ".mov", ".mkv", ".webm")]
-    if not media:
-        return None
-    mp4s = [p for p in media if p.suffix.lower() == ".mp4"]
-    pool = mp4s or media
-    pool.sort(key=lambda p: (p.stat().st_size, p.stat().st_mtime), reverse=True)
-    return pool[0]
+    # Fallback when no yt-dlp hook reported the output. Largest file wins, MP4 preferred;
+    # outtmpl writes straight into dirpath, so one scandir level is enough.
+    best, best_key = None, None
+    with os.scandir(dirpath) as it:
+        for entry in it:
+            ext = entry.name.rpartition(".")[2].lower()
+            if ext not in _MEDIA_EXTS or not entry.is_file():
+                continue
+            st = entry.stat()
+            key = (ext == "mp4", st.st_size, st.st_mtime)
+            if best_key is None or key > best_key:
+                best, best_key = entry.path, key
+    return Path(best) if best else None
 
-def _make_ydl_opts(tmpdir: Path, fmt: str, cookiefile: str | None = None):
-    ydl_opts = {
-        "outtmpl": str(tmpdir / "%(title).80s-%(id)s.%(ext)s"),
-        "noplaylist": True,
-        "quiet": True,
-        "nocheckcertificate": True,
-        "retries": 3,
-        "concurrent_fragment_downloads": 4,
-        "merge_output_format": "mp4",
-        "http_headers": {
-            "User-Agent": (
-                "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-                "AppleWebKit/537.36 (KHTML, like Gecko) "
-                "Chrome/124.0 Safari/537.36"
-            )
-        },
-        "format": fmt,
+# Final output path per download dir, reported by yt-dlp hooks (saves a directory walk).
+_FINAL_FILES: dict[str, str] = {}
+
+def _remember_final_file(d: dict) -> None:
+    if d.get("status") != "finished":
+        return
+    fp = (d.get("info_dict") or {}).get("filepath") or d.get("filename")
+    if fp:
+        _FINAL_FILES[os.path.dirname(os.path.abspath(fp))] = fp
+
+def _outtmpl(tmpdir: Path) -> str:
+    return str(tmpdir / "%(title).80s-%(id)s.%(ext)s")
+
+# Everything that does not vary per download, built once; _make_ydl_opts fills in the rest.
+_YDL_OPTS_TEMPLATE = {
+    "noplaylist": True,
+    "quiet": True,
+    "nocheckcertificate": True,
+    "retries": 3,
+    "concurrent_fragment_downloads": CONCURRENT_FRAGMENTS,
+    "fragment_retries": 10,
+    "http_chunk_size": 10 * 1024 * 1024,
+    "merge_output_format": "mp4",
+    "http_headers": {
+        "User-Agent": (
+            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+            "AppleWebKit/537.36 (KHTML, like Gecko) "
+            "Chrome/124.0 Safari/537.36"
+        )
+    },
+    "progress_hooks": [_remember_final_file],
+    "postprocessor_hooks": [_remember_final_file],
+}
+if HAS_ARIA2C:
+    # Multi-connection range GETs for progressive files; fragmented streams stay native.
+    _YDL_OPTS_TEMPLATE["external_downloader"] = {"default": "aria2c", "m3u8": "native", "dash": "native"}
+    _YDL_OPTS_TEMPLATE["external_downloader_args"] = {
+        "aria2c": ["-x16", "-s16", "-k1M", "--summary-interval=0", "--console-log-level=warn"],
     }
-    if not NO_FFMPEG:
-        ydl_opts["postprocessors"] = [{"key": "FFmpegVideoConvertor", "preferedformat": "mp4"}]
+if not NO_FFMPEG:
+    _YDL_OPTS_TEMPLATE["postprocessors"] = [{"key": "FFmpegVideoConvertor", "preferedformat": "mp4"}]
+
+def _make_ydl_opts(tmpdir: Path, fmt: str, cookiefile: str | None = None):
+    ydl_opts = _YDL_OPTS_TEMPLATE.copy()
+    ydl_opts["outtmpl"] = _outtmpl(tmpdir)
+    ydl_opts["format"] = fmt
     if cookiefile:
         ydl_opts["cookiefile"] = cookiefile
     return ydl_opts
 
+# Idle YoutubeDL instances, reused so extractor setup is paid once per worker rather than
+# per download. Instances are never shared between concurrent downloads.
+_YDL_POOL: dict[tuple, list[yt_dlp.YoutubeDL]] = {}
+_YDL_POOL_LOCK = threading.Lock()
+
+def _set_format(ydl: yt_dlp.YoutubeDL, fmt: str) -> None:
+    # YoutubeDL compiles the selector in __init__; params["format"] alone is not re-read.
+    ydl.params["format"] = fmt
+    ydl.format_selector = ydl.build_format_selector(fmt)
+
+@contextmanager
+def _pooled_ydl(tmpdir: Path, fmt: str, cookiefile: str | None = None):
+    key = (NO_FFMPEG, cookiefile is not None)
+    with _YDL_POOL_LOCK:
+        idle = _YDL_POOL.get(key)
+        ydl = idle.pop() if idle else None
+    if ydl is None:
+        ydl = yt_dlp.YoutubeDL(_make_ydl_opts(tmpdir, fmt, cookiefile))
+    else:
+        ydl.params["outtmpl"] = {"default": _outtmpl(tmpdir)}
+        if cookiefile:
+            ydl.params["cookiefile"] = cookiefile
+        _set_format(ydl, fmt)
+    try:
+        yield ydl
+    finally:
+        with _YDL_POOL_LOCK:
+            _YDL_POOL.setdefault(key, []).append(ydl)
+
+_UNITS = ("B", "KB", "MB", "GB", "TB", "PB")
+
 def _human(n: int) -> str:
-    for unit in ("B", "KB", "MB", "GB", "TB"):
-        if n < 1024:
-            return f"{n:.0f} {unit}"
-        n /= 1024
-    return f"{n:.1f} PB"
-
-def _estimated_too_big(info: dict) -> bool:
-    size_keys = ("filesize", "filesize_approx")
-    for k in size_keys:
-        v = info.get(k)
-        if isinstance(v, (int, float)) and v > MAX_TG_BYTES:
-            return True
-    total = 0
+    if n < 1024:
+        return f"{max(n, 0)} B"
+    u = min((n.bit_length() - 1) // 10, 5)
+    return f"{n / (1 << (u * 10)):.1f} {_UNITS[u]}"
+
+def _format_size(f: dict, duration: float | None) -> int:
+    v = f.get("filesize") or f.get("filesize_approx")
+    if isinstance(v, (int, float)):
+        return int(v)
+    # YouTube often omits sizes; bitrate (kbit/s) × duration is close enough to reject early.
+    return int((f.get("tbr") or f.get("vbr") or 0) * 1000 * (duration or 0) / 8)
+
+def _estimated_size(info: dict, duration: float | None = None) -> int:
+    duration = duration or info.get("duration")
+    size = _format_size(info, duration)
     if "requested_formats" in info and isinstance(info["requested_formats"], list):
-        for f in info["requested_formats"]:
-            for k in size_keys:
-                v = f.get(k)
-                if isinstance(v, (int, float)):
-                    total += int(v)
-        if total and total > MAX_TG_BYTES:
-            return True
-    return False
+        size = max(size, sum(_format_size(f, duration) for f in info["requested_formats"]))
+    return size
+
+def _estimated_too_big(info: dict, duration: float | None = None) -> bool:
+    return _estimated_size(info, duration) > MAX_TG_BYTES
+
+# Best → downscale ladder if over Telegram limit
+_LADDER_NOFFMPEG = (
+    "best[ext=mp4]/best",
+    "best[ext=mp4][height<=720]/best[height<=720]",
+    "best[ext=mp4][height<=480]/best[height<=480]",
+    "best[ext=mp4][height<=360]/best[height<=360]",
+)
+_LADDER_FFMPEG = (
+    "bv*+ba/best",
+    "bv*[height<=720]+ba/b[height<=720]/best",
+    "bv*[height<=480]+ba/b[height<=480]/best",
+    "bv*[height<=360]+ba/b[height<=360]/best",
+)
 
-def _extract_and_download(url: str, tmpdir: Path, cookiefile: str | None = None):
-    title = "video"
-    # Best → downscale ladder if over Telegram limit
-    if NO_FFMPEG:
-        ladder = [
-            "best[ext=mp4]/best",
-            "best[ext=mp4][height<=720]/best[height<=720]",
-            "best[ext=mp4][height<=480]/best[height<=480]",
-            "best[ext=mp4][height<=360]/best[height<=360]",
-        ]
-    else:
-        ladder = [
-            "bv*+ba/best",
-            "bv*[height<=720]+ba/b[height<=720]/best",
-            "bv*[height<=480]+ba/b[height<=480]/best",
-            "bv*[height<=360]+ba/b[height<=360]/best",
-        ]
-
-    chosen = ladder[0]
-    with yt_dlp.YoutubeDL(_make_ydl_opts(tmpdir, chosen, cookiefile)) as ydl:
-        for fmt in ladder:
-            try:
-                ydl.params["format"] = fmt
-                info = ydl.extract_info(url, download=False)
-                title = info.get("title") or title
-                if not _estimated_too_big(info):
-                    chosen = fmt
+def _head_fill_size(ydl, f: dict) -> None:
+    # Many progressive formats come without a size; one HEAD tells us before committing to a download.
+    if f.get("filesize") or f.get("filesize_approx") or f.get("protocol") not in ("http", "https"):
+        return
+    try:
+        req = yt_dlp.networking.Request(f["url"], headers=f.get("http_headers") or {}, method="HEAD")
+        with ydl.urlopen(req) as resp:
+            length = resp.headers.get("Content-Length")
+    except Exception:
+        return
+    if length and length.isdigit():
+        f["filesize"] = int(length)
+
+def _pick_ladder_format(ydl, info: dict, ladder: tuple[str, ...]) -> dict | None:
+    formats = info.get("formats") or [info]
+    ctx = {
+        "formats": formats,
+        "has_merged_format": any("none" not in (f.get("acodec"), f.get("vcodec")) for f in formats),
+        "incomplete_formats": (
+            all(f.get("vcodec") == "none" for f in formats)
+            or all(f.get("acodec") == "none" for f in formats)
+        ),
+    }
+    for fmt in ladder:
+        try:
+            selected = list(ydl.build_format_selector(fmt)(ctx))
+        except Exception:
+            continue
+        if not selected:
+            continue
+        for f in selected[0].get("requested_formats") or [selected[0]]:
+            _head_fill_size(ydl, f)
+        if not _estimated_too_big(selected[0], info.get("duration")):
+            return selected[0]
+    return None
+
+# Recent probe results by URL: re-sent links skip the extractor. Entries are deep-copied on the
+# way in and out because downloading mutates the info dict.
+META_CACHE_TTL = 300
+META_CACHE_MAX = 256
+_META_CACHE: dict[tuple, tuple[float, tuple]] = {}
+_META_CACHE_LOCK = threading.Lock()
+
+def _meta_cache_get(key: tuple) -> tuple | None:
+    with _META_CACHE_LOCK:
+        hit = _META_CACHE.get(key)
+        if hit and time.monotonic() - hit[0] < META_CACHE_TTL:
+            return copy.deepcopy(hit[1])
+        _META_CACHE.pop(key, None)
+    return None
+
+def _meta_cache_put(key: tuple, value: tuple) -> None:
+    value = copy.deepcopy(value)
+    with _META_CACHE_LOCK:
+        _META_CACHE.pop(key, None)
+        _META_CACHE[key] = (time.monotonic(), value)
+        while len(_META_CACHE) > META_CACHE_MAX:
+            del _META_CACHE[next(iter(_META_CACHE))]
+
+def _meta_cache_drop(url: str, cookiefile: str | None) -> None:
+    # A failed download may mean the cached format URLs expired or are IP-bound; re-probe next time.
+    with _META_CACHE_LOCK:
+        _META_CACHE.pop((url, cookiefile is not None), None)
+
+def _is_multi_item(info: dict) -> bool:
+    return info.get("_type") == "playlist" or "formats" not in info
+
+def _probe(url: str, tmpdir: Path, cookiefile: str | None = None):
+    ladder = _LADDER_NOFFMPEG if NO_FFMPEG else _LADDER_FFMPEG
+    key = (url, cookiefile is not None)
+    cached = _meta_cache_get(key)
+    if cached:
+        return cached
+
+    with _pooled_ydl(tmpdir, ladder[0], cookiefile) as ydl:
+        # Probe once and walk the ladder offline against the probed formats.
+        info = ydl.extract_info(url, download=False)
+        # Carousels and multi-video posts come back as playlists: no formats to rank here,
+        # so each entry is downloaded with the top rung.
+        selected = None if _is_multi_item(info) else _pick_ladder_format(ydl, info, ladder)
+    fmt = selected["format_id"] if selected else ladder[0]
+    _meta_cache_put(key, (info, fmt, selected))
+    return info, fmt, selected
+
+def _download_probed(info: dict, fmt: str, tmpdir: Path, cookiefile: str | None = None) -> Path:
+    # Download from the probed info dict instead of re-extracting.
+    try:
+        with _pooled_ydl(tmpdir, fmt, cookiefile) as ydl:
+            ydl.process_ie_result(info, download=True)
+    finally:
+        reported = _FINAL_FILES.pop(os.path.abspath(tmpdir), None)
+    # The hook only remembers the last entry of a multi-item post; send the largest, as before.
+    out_file = Path(reported) if reported and not _is_multi_item(info) else _pick_final_file(tmpdir)
+    if not out_file or not out_file.exists():
+        raise RuntimeError("Downloaded file not found (post-processing may have failed).")
+    return out_file
+
+_FETCH_GATING_HEADERS = frozenset(("referer", "origin", "cookie", "authorization"))
+
+# URL Telegram can fetch itself: a public, single-file MP4 under its URL-upload limit.
+def _direct_url(selected: dict | None, cookiefile: str | None) -> str | None:
+    if not selected or cookiefile or selected.get("requested_formats") or selected.get("cookies"):
+        return None
+    # Telegram fetches with its own plain request: anything gated on Referer/Origin/auth fails.
+    if any(h.lower() in _FETCH_GATING_HEADERS for h in selected.get("http_headers") or {}):
+        return None
+    if selected.get("ext") != "mp4" or selected.get("protocol") not in ("http", "https"):
+        return None
+    size = selected.get("filesize") or selected.get("filesize_approx")
+    if not size or size >= TG_URL_FETCH_BYTES:
+        return None
+    return selected.get("url")
+
+def _fast_rmtree(path) -> None:
+    # scandir's cached d_type saves a stat per entry compared to shutil.rmtree's walk.
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        _fast_rmtree(entry.path)
+                    else:
+                        os.unlink(entry.path)
+                except OSError:
+                    pass
+        os.rmdir(path)
+    except OSError:
+        pass
+
+_STREAMABLE_EXTS = (".mp4", ".mov")
+
+async def _cleanup(dirs: list[Path], reserved: int) -> None:
+    try:
+        for d in dirs:
+            await asyncio.to_thread(_fast_rmtree, d)
+    finally:
+        _release_ram(reserved)
+
+_BACKGROUND_TASKS: set[asyncio.Task] = set()
+
+def _spawn(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    _BACKGROUND_TASKS.add(task)
+    task.add_done_callback(_BACKGROUND_TASKS.discard)
+    return task
+
+# Throttles status edits under Telegram's editMessageText rate limit: repeats and edits within
+# min_interval of the last one are dropped, final edits always go out, RetryAfter pauses all.
+class EditLimiter:
+    def __init__(self, min_interval: float = 1.2):
+        self.min_interval = min_interval
+        self._last: dict[tuple[int, int], tuple[str, float]] = {}
+        self._paused_until = 0.0
+
+    async def edit(self, message, text: str, final: bool = False) -> None:
+        loop = asyncio.get_running_loop()
+        key = (message.chat_id, message.message_id)
+        last_text, last_ts = self._last.get(key, (None, 0.0))
+        if text == last_text or (not final and loop.time() - last_ts < self.min_interval):
+            return
+        try:
+            for _ in range(2):
+                delay = self._paused_until - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                try:
+                    await message.edit_text(text)
+                except RetryAfter as e:
+                    retry = e.retry_after
+                    retry = retry.total_seconds() if hasattr(retry, "total_seconds") else float(retry)
+                    self._paused_until = max(self._paused_until, loop.time() + retry)
+                else:
+                    # Only a delivered edit counts, so a failed one can be retried as-is.
+                    self._last[key] = (text, loop.time())
                     break
-            except Exception:
-                continue
+        finally:
+            if final:
+                self.forget(message)
 
-    with yt_dlp.YoutubeDL(_make_ydl_opts(tmpdir, chosen, cookiefile)) as ydl:
-        ydl.extract_info(url, download=True)
+    def forget(self, message) -> None:
+        self._last.pop((message.chat_id, message.message_id), None)
 
-    out_file = _pick_final_file(tmpdir)
-    if not out_file or not out_file.exists():
-        raise RuntimeError("Downloaded file not found (post-processing may have failed).")
-    return out_file, title
+_limiter = EditLimiter()
+
+async def _progress_edit(message, text: str) -> None:
+    # Runs as a background task: a failed progress edit is only worth a log line.
+    try:
+        await _limiter.edit(message, text)
+    except Exception as e:
+        log.warning("Status edit failed: %s", e)
+
+_SEM = asyncio.Semaphore(MAX_PARALLEL_DOWNLOADS)
+# chat_id -> (semaphore, downloads holding or waiting on it); dropped when the count hits 0
+# so idle chats don't accumulate.
+_CHAT_SEMAPHORES: dict[int, tuple[asyncio.Semaphore, int]] = {}
+
+@asynccontextmanager
+async def _chat_slot(chat_id: int):
+    sem, users = _CHAT_SEMAPHORES.get(chat_id, (None, 0))
+    if sem is None:
+        sem = asyncio.Semaphore(MAX_PARALLEL_DL)
+    _CHAT_SEMAPHORES[chat_id] = (sem, users + 1)
+    try:
+        async with sem:
+            yield
+    finally:
+        sem, users = _CHAT_SEMAPHORES[chat_id]
+        if users == 1:
+            del _CHAT_SEMAPHORES[chat_id]
+        else:
+            _CHAT_SEMAPHORES[chat_id] = (sem, users - 1)
 
 # ------------ Handlers ------------
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    lang = get_lang(update)
-    mode = t(lang, "mode_noff") if NO_FFMPEG else t(lang, "mode_ff")
-    msg = t(lang, "start", mode=mode) + "\n\n" + t(lang, "help_hint")
-    await update.effective_message.reply_html(msg)
+    await update.effective_message.reply_html(_START_RENDERED[get_lang(update)])
 
 async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     await start(update, context)
@@ -233,43 +613,108 @@ async def lang_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await update.effective_message.reply_text(t(get_lang(update), "lang_usage"))
 
 async def _download_and_send(url: str, update: Update) -> None:
+    async with _chat_slot(update.effective_chat.id), _SEM:
+        try:
+            await _download_and_send_locked(url, update)
+        except Exception:
+            # Never let one link's failure cancel its siblings in handle_message's TaskGroup.
+            log.exception("Failed to process %s", url)
+
+async def _download_and_send_locked(url: str, update: Update) -> None:
     lang = get_lang(update)
     msg = update.effective_message
-    tmpdir = Path(tempfile.mkdtemp(prefix="dl_"))
+    tmpdir = Path(tempfile.mkdtemp(prefix="dl_", dir=_RAM_TMP_ROOT))
+    dirs = [tmpdir]
+    reserved = 0
+    status = progress_edit = None
     cookiefile = None
     try:
         if "instagram." in url and IG_SESSIONID:
             cookiefile = _write_cookies_if_needed(tmpdir)
 
         status = await msg.reply_text(t(lang, "downloading", url=url))
-        filepath, title = await asyncio.to_thread(_extract_and_download, url, tmpdir, cookiefile)
+        info, fmt, selected = await asyncio.to_thread(_probe, url, tmpdir, cookiefile)
+        title = info.get("title") or "video"
+
+        # Small public MP4s: let Telegram pull the file, skipping our download and upload.
+        direct = _direct_url(selected, cookiefile)
+        if direct:
+            try:
+                await msg.reply_video(
+                    video=direct, caption=f"{title}", supports_streaming=True, read_timeout=UPLOAD_TIMEOUT,
+                )
+            except BadRequest:
+                log.info("Telegram could not fetch %s directly, downloading instead", url)
+            else:
+                await _limiter.edit(status, t(lang, "done"), final=True)
+                return
+
+        dl_dir = tmpdir
+        if _RAM_TMP_ROOT:
+            reserved = _reserve_ram(_estimated_size(selected or info, info.get("duration")))
+        if _RAM_TMP_ROOT and not reserved:
+            dl_dir = Path(tempfile.mkdtemp(prefix="dl_"))
+            dirs.append(dl_dir)
+        filepath = await asyncio.to_thread(_download_probed, info, fmt, dl_dir, cookiefile)
 
         size = filepath.stat().st_size
         if size > MAX_TG_BYTES:
-            await status.edit_text(t(lang, "too_big", size=_human(size), limit=_human(MAX_TG_BYTES)))
+            await _limiter.edit(status, t(lang, "too_big", size=_human(size), limit=_human(MAX_TG_BYTES)), final=True)
             return
 
-        await status.edit_text(t(lang, "uploading"))
-        try:
-            await msg.reply_video(video=filepath.open("rb"), caption=f"{title}", supports_streaming=True)
-        except Exception:
-            await msg.reply_document(document=filepath.open("rb"), caption=f"{title}")
-        await status.edit_text(t(lang, "done"))
+        # Progress edits run alongside the upload; the terminal edit waits for them to keep order.
+        progress_edit = _spawn(_progress_edit(status, t(lang, "uploading")))
+        # read_file_handle=False hands the open file to httpx, which streams it in small chunks
+        # instead of PTB buffering the whole upload in memory; only the open() may stall on disk.
+        fh = await asyncio.to_thread(filepath.open, "rb")
+        with fh:
+            # Only MP4/MOV play inline; anything else goes straight to a document upload rather
+            # than uploading the whole file once as a video just to have it rejected.
+            sent = False
+            if filepath.suffix.lower() in _STREAMABLE_EXTS:
+                try:
+                    await msg.reply_video(
+                        video=InputFile(fh, filename=filepath.name, read_file_handle=False),
+                        caption=f"{title}", supports_streaming=True,
+                        read_timeout=UPLOAD_TIMEOUT, write_timeout=UPLOAD_TIMEOUT, pool_timeout=UPLOAD_TIMEOUT,
+                    )
+                    sent = True
+                except BadRequest:
+                    fh.seek(0)
+            if not sent:
+                await msg.reply_document(
+                    document=InputFile(fh, filename=filepath.name, read_file_handle=False),
+                    caption=f"{title}",
+                    read_timeout=UPLOAD_TIMEOUT, write_timeout=UPLOAD_TIMEOUT, pool_timeout=UPLOAD_TIMEOUT,
+                )
+        await progress_edit
+        await _limiter.edit(status, t(lang, "done"), final=True)
     except yt_dlp.utils.DownloadError as e:
+        _meta_cache_drop(url, cookiefile)
         await msg.reply_text(t(lang, "dl_error", err=e))
     except Exception as e:
+        _meta_cache_drop(url, cookiefile)
         await msg.reply_text(t(lang, "error", err=e))
     finally:
-        shutil.rmtree(tmpdir, ignore_errors=True)
+        if progress_edit and not progress_edit.done():
+            progress_edit.cancel()
+        if status is not None:
+            _limiter.forget(status)
+        # Clean up off the loop and without awaiting, so the next download is not held up.
+        _spawn(_cleanup(dirs, reserved))
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    text = update.effective_message.text or ""
-    urls = [u for u in find_urls(text) if is_supported_url(u)]
+    urls = _message_urls(update.effective_message)
     if not urls:
         await update.effective_message.reply_text(t(get_lang(update), "send_supported"))
         return
-    for url in urls:
-        await _download_and_send(url, update)
+    # Links are independent and network-bound: fetch them side by side.
+    if hasattr(asyncio, "TaskGroup"):
+        async with asyncio.TaskGroup() as tg:
+            for url in urls:
+                tg.create_task(_download_and_send(url, update))
+    else:
+        await asyncio.gather(*(_download_and_send(u, update) for u in urls), return_exceptions=True)
 
 async def set_bot_commands(app: Application) -> None:
     # Menu in both languages
@@ -281,21 +726,26 @@ async def set_bot_commands(app: Application) -> None:
         BotCommand("lang",  "Set language: ru|en / Язык: ru|en"),
     ])
 
+# Built once; URL_RE is already compiled, so filters.Regex uses it as-is.
+_MSG_FILTER = filters.TEXT & (
+    filters.Entity(MessageEntityType.URL) | filters.Entity(MessageEntityType.TEXT_LINK) | filters.Regex(URL_RE)
+)
+
 def main() -> None:
     token = os.getenv("BOT_TOKEN")
     if not token:
         raise SystemExit("BOT_TOKEN environment variable is required")
 
-    app = Application.builder().token(token).build()
+    # One long-lived HTTP/2 pool to api.telegram.org, wide enough for concurrent downloads per chat.
+    request = HTTPXRequest(connection_pool_size=32, pool_timeout=10, http_version="2")
+    # Handle updates from different chats concurrently; downloads are bounded by _SEM.
+    app = Application.builder().token(token).request(request).concurrent_updates(True).build()
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", help_cmd))
     app.add_handler(CommandHandler("sites", sites_cmd))
     app.add_handler(CommandHandler("about", about_cmd))
     app.add_handler(CommandHandler("lang", lang_cmd))
-    app.add_handler(MessageHandler(
-        filters.TEXT & (filters.Entity(MessageEntityType.URL) | filters.Entity(MessageEntityType.TEXT_LINK) | filters.Regex(URL_RE)),
-        handle_message,
-    ))
+    app.add_handler(MessageHandler(_MSG_FILTER, handle_message))
 
     log.info("Bot is starting… (NO_FFMPEG=%s)", NO_FFMPEG)
 